@@ -2,25 +2,97 @@
 
 from __future__ import annotations
 
+import codecs
+import hashlib
 import json
 import random
 import re
+import threading
 import time
-from dataclasses import dataclass
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
 from io import BytesIO
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 from google import genai
+from google.genai import types
 from google.genai.errors import APIError
-from PIL import Image
+from PIL import Image, ImageOps
+
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:  # orjson 可选，未安装时退回标准库
+    _json_loads = json.loads
 
 DEFAULT_HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
     "Accept-Language": "en-US,en;q=0.9,zh-CN,zh;q=0.7",
 }
 
+ASIN_DP_RE = re.compile(r"/dp/([A-Z0-9]{10})", re.IGNORECASE)
+ASIN_BARE_RE = re.compile(r"\b([A-Z0-9]{10})\b", re.IGNORECASE)
+_JSON_BLOB_RE = re.compile(r"\{.*\}", re.DOTALL)
+_JSON_ARRAY_RE = re.compile(r"\[.*\]", re.DOTALL)
+
+# PIL 识别出的格式中 Gemini 可直接接受的（HEIC/HEIF 另行处理）；其它格式需转码
+_PIL_FORMAT_MIME_TYPES = {"JPEG": "image/jpeg", "MPO": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+# 限流/服务端临时故障，值得退避后重试
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# 侧边栏允许把延迟设为 0，退避基数和 Amazon 请求间隔至少按此计算
+_MIN_DELAY_FLOOR_SECONDS = 1.0
+
+_CAPTCHA_RE = re.compile(
+    r"type the characters|enter the characters|automated access|/errors/validatecaptcha|captcha.{0,200}amazon",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# 模型结果缓存：同一模型 + 同一提示词 + 同一图片直接复用上次的分析结果
+_RESPONSE_CACHE: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_RESPONSE_CACHE_MAX = 2048
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+
+def build_session() -> requests.Session:
+    # 复用连接池，避免每行都重新建立 TCP/TLS 连接
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# 线程安全的限速器：所有并发 worker 共享同一份配额，相邻两次调用至少间隔 time_period / max_rate 秒
+class RateLimiter:
+    def __init__(self, max_rate: float, time_period: float = 1.0) -> None:
+        self._interval = time_period / max_rate if max_rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self) -> None:
+        if self._interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def __enter__(self) -> "RateLimiter":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        return None
+
 
 @dataclass
 class AnalyzerConfig:
@@ -30,89 +102,271 @@ class AnalyzerConfig:
     min_delay_seconds: float = 2.0
     max_delay_seconds: float = 6.0
     verify_ssl: bool = True
+    concurrency: int = 4
+    batch_size: int = 5
+    cache_ttl_seconds: float = 24 * 3600
+    gemini_max_rate: float = 10.0
+    image_max_side: int = 768
     headers: Optional[Dict[str, str]] = None
+    session: requests.Session = field(default_factory=build_session, repr=False)
+    amazon_limiter: RateLimiter = field(init=False, repr=False)
+    gemini_limiter: RateLimiter = field(init=False, repr=False)
+    seller_cache: Dict[str, "Future[Tuple[str, str]]"] = field(init=False, default_factory=dict, repr=False)
+    seller_cache_lock: threading.Lock = field(init=False, default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self) -> None:
+        # Amazon 每 min_delay_seconds（至少 1 秒）最多一个请求；Gemini 每秒最多 gemini_max_rate 个请求
+        self.amazon_limiter = RateLimiter(1, max(self.min_delay_seconds, _MIN_DELAY_FLOOR_SECONDS))
+        self.gemini_limiter = RateLimiter(self.gemini_max_rate, 1.0)
+
+
+@dataclass
+class ProductRow:
+    product_title: str
+    product_desc: str
+    asin: str  # 已规范化的 ASIN（见 app.py 的批量提取）
+    image_url: Optional[str] = None
+    brand_override: Optional[str] = None
+    sold_by_override: Optional[str] = None
 
 
 def _sleep_jitter(min_s: float, max_s: float) -> None:
     time.sleep(random.uniform(min_s, max_s))
 
 
+def _sleep_backoff(attempt: int, cfg: AnalyzerConfig) -> None:
+    # 指数退避 + 抖动：短暂故障很快重试，持续被拦截时等待时间逐次翻倍
+    base = max(cfg.max_delay_seconds, _MIN_DELAY_FLOOR_SECONDS)
+    time.sleep(min(base * (2**attempt), 60.0) + random.uniform(0, 1))
+
+
 def extract_asin(value: str) -> Optional[str]:
     if not value:
         return None
     s = str(value).strip()
-    m = re.search(r"/dp/([A-Z0-9]{10})", s, re.IGNORECASE)
+    m = ASIN_DP_RE.search(s)
     if m:
         return m.group(1).upper()
-    m = re.search(r"\b([A-Z0-9]{10})\b", s, re.IGNORECASE)
+    m = ASIN_BARE_RE.search(s)
     if m:
         return m.group(1).upper()
     return None
 
 
-def download_image_as_pil(url: str, cfg: AnalyzerConfig) -> Optional[Image.Image]:
+def download_image(url: str, cfg: AnalyzerConfig) -> Optional[Tuple[str, bytes]]:
     if not url or not str(url).startswith("http"):
         return None
     try:
-        resp = requests.get(
+        resp = cfg.session.get(
             str(url),
-            headers=cfg.headers or DEFAULT_HEADERS,
+            headers=cfg.headers,
             timeout=cfg.timeout_seconds,
             verify=cfg.verify_ssl,
         )
         resp.raise_for_status()
-        return Image.open(BytesIO(resp.content))
+        if not resp.content:
+            return None
+        mime_type = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        image = _normalize_image(mime_type, resp.content)
+        if image is None:
+            return None
+        return _downscale_image(*image, cfg)
     except Exception:
         return None
 
 
+def _normalize_image(mime_type: str, data: bytes) -> Optional[Tuple[str, bytes]]:
+    # 类型头只作参考：以 PIL 识别出的格式为准（只读文件头，不解码像素），
+    # 防止把标成 image/jpeg 的 HTML/错误页当图片发给 Gemini；Gemini 不支持的格式转码，识别不了就跳过图片
+    try:
+        img = Image.open(BytesIO(data))
+    except Exception:
+        # 未装 HEIF 插件时 PIL 打不开 HEIC/HEIF，按容器头（ftyp）确认后原样上传
+        if mime_type in ("image/heic", "image/heif") and data[4:8] == b"ftyp":
+            return mime_type, data
+        return None
+    try:
+        detected = _PIL_FORMAT_MIME_TYPES.get(img.format or "")
+        if detected:
+            return detected, data
+        return _encode_image(ImageOps.exif_transpose(img))
+    except Exception:
+        return None
+
+
+def _encode_image(img: Image.Image) -> Tuple[str, bytes]:
+    buf = BytesIO()
+    if img.mode in ("RGBA", "LA") or "transparency" in img.info:
+        img.save(buf, "PNG", optimize=True)
+        return "image/png", buf.getvalue()
+    img.convert("RGB").save(buf, "JPEG", quality=85)
+    return "image/jpeg", buf.getvalue()
+
+
+def _downscale_image(mime_type: str, data: bytes, cfg: AnalyzerConfig) -> Tuple[str, bytes]:
+    # 视觉 token 取决于像素尺寸而非文件大小：最长边超过 image_max_side 才缩放，
+    # Image.open 只读文件头，不超限的图不会解码像素
+    try:
+        img = Image.open(BytesIO(data))
+        if max(img.size) <= cfg.image_max_side:
+            return mime_type, data
+        # 重新编码会丢掉 EXIF，先按 Orientation 把像素转正，否则手机拍的图会歪
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((cfg.image_max_side, cfg.image_max_side), Image.LANCZOS)
+        return _encode_image(img)
+    except Exception:
+        return mime_type, data
+
+
 def _looks_like_captcha(html: str) -> bool:
-    if not html:
-        return False
-    lower = html.lower()
-    return (
-        "type the characters" in lower
-        or "enter the characters" in lower
-        or "automated access" in lower
-        or "/errors/validatecaptcha" in lower
-        or ("captcha" in lower and "amazon" in lower)
-    )
+    return bool(html) and _CAPTCHA_RE.search(html) is not None
+
+
+def _seller_info_target(tag: str, attrs: List[Tuple[str, Optional[str]]]) -> Optional[str]:
+    attr_map = dict(attrs)
+    if tag == "a" and attr_map.get("id") == "bylineInfo":
+        return "byline"
+    if tag == "div" and attr_map.get("id") == "merchant-info":
+        return "merchant"
+    if tag == "span" and "po-brand" in (attr_map.get("class") or "").split():
+        return "po_brand"
+    return None
+
+
+# 增量解析：只收集品牌和销售方节点的文本，两者都拿到后即可停止下载
+class _SellerInfoParser(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.texts: Dict[str, List[str]] = {}
+        self.finished: set = set()
+        self._open: Dict[str, List[Any]] = {}
+        self._skip_depth = 0
+        # 跨 chunk 的同一段文本会分多次回调，需拼回一个字符串再 strip
+        self._in_text = False
+
+    @property
+    def done(self) -> bool:
+        return {"byline", "merchant"} <= self.finished
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self._in_text = False
+        if tag in ("script", "style"):
+            self._skip_depth += 1
+            return
+        for state in self._open.values():
+            if state[0] == tag:
+                state[1] += 1
+        key = _seller_info_target(tag, attrs)
+        if key and key not in self.texts:
+            self.texts[key] = []
+            self._open[key] = [tag, 1]
+
+    def handle_endtag(self, tag: str) -> None:
+        self._in_text = False
+        if tag in ("script", "style"):
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        for key, state in list(self._open.items()):
+            if state[0] == tag:
+                state[1] -= 1
+                if state[1] == 0:
+                    del self._open[key]
+                    self.finished.add(key)
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_depth:
+            return
+        for key in self._open:
+            parts = self.texts[key]
+            if self._in_text and parts:
+                parts[-1] += data
+            else:
+                parts.append(data)
+        self._in_text = True
+
+    def handle_comment(self, data: str) -> None:
+        self._in_text = False
+
+    def get_text(self, key: str, separator: str = "") -> Optional[str]:
+        if key not in self.texts:
+            return None
+        return separator.join(s.strip() for s in self.texts[key] if s.strip())
+
+
+def _response_decoder(resp: requests.Response) -> codecs.IncrementalDecoder:
+    try:
+        return codecs.getincrementaldecoder(resp.encoding or "utf-8")(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+def _read_seller_info(resp: requests.Response) -> Tuple[_SellerInfoParser, str]:
+    # 品牌和销售方信息通常在页面前 200KB 内，解析到后直接中断下载
+    parser = _SellerInfoParser()
+    decoder = _response_decoder(resp)
+    received: List[str] = []
+    for chunk in resp.iter_content(64 * 1024):
+        text = decoder.decode(chunk)
+        received.append(text)
+        parser.feed(text)
+        if parser.done:
+            break
+    else:
+        text = decoder.decode(b"", final=True)
+        received.append(text)
+        parser.feed(text)
+        parser.close()
+    return parser, "".join(received)
 
 
 def get_amazon_seller_info(asin: str, cfg: AnalyzerConfig) -> Tuple[str, str]:
     url = f"https://www.amazon.com/dp/{asin}"
-    headers = cfg.headers or DEFAULT_HEADERS
 
     last_error: Optional[str] = None
     for attempt in range(cfg.max_retries):
         try:
-            resp = requests.get(
-                url,
-                headers=headers,
-                timeout=cfg.timeout_seconds,
-                verify=cfg.verify_ssl,
-            )
-            resp.raise_for_status()
-
-            if _looks_like_captcha(resp.text):
+            with cfg.amazon_limiter:
+                resp = cfg.session.get(
+                    url,
+                    headers=cfg.headers,
+                    timeout=cfg.timeout_seconds,
+                    verify=cfg.verify_ssl,
+                    stream=True,
+                )
+            with resp:
+                if resp.status_code in _RETRYABLE_STATUS:
+                    last_error = f"HTTP {resp.status_code}"
+                    if attempt < cfg.max_retries - 1:
+                        _sleep_backoff(attempt, cfg)
+                        continue
+                    return f"爬虫失败 ({last_error})", f"爬虫失败 ({last_error})"
+                resp.raise_for_status()
+
+                # 关键：不要用 lxml，避免 Streamlit Cloud 构建/运行卡死；这里用标准库 html.parser
+                parser, html = _read_seller_info(resp)
+
+            if not parser.done and _looks_like_captcha(html):
                 return "Captcha Blocked", "Captcha Blocked"
 
-            # 关键：不要用 lxml，避免 Streamlit Cloud 构建/运行卡死
-            soup = BeautifulSoup(resp.text, "html.parser")
-
-            brand_element = soup.find("a", id="bylineInfo") or soup.find("span", class_="po-brand")
-            brand = brand_element.get_text(strip=True) if brand_element else "Brand Not Found"
+            brand = parser.get_text("byline")
+            if brand is None:
+                brand = parser.get_text("po_brand")
+            brand = brand if brand is not None else "Brand Not Found"
             brand = brand.replace("Visit the ", "").replace(" Store", "").strip()
 
-            sold_by_element = soup.find("div", id="merchant-info")
-            sold_by = sold_by_element.get_text(" ", strip=True) if sold_by_element else "Sold By Not Found"
+            sold_by = parser.get_text("merchant", " ")
+            if sold_by is None:
+                sold_by = "Sold By Not Found"
 
-            _sleep_jitter(cfg.min_delay_seconds, cfg.max_delay_seconds)
             return brand, sold_by
+        except requests.exceptions.HTTPError as e:
+            # 404 等非临时性错误重试也无济于事，直接返回
+            last_error = f"HTTP {getattr(e.response, 'status_code', '')}".strip()
+            return f"爬虫失败 ({last_error})", f"爬虫失败 ({last_error})"
         except requests.exceptions.RequestException as e:
             last_error = e.__class__.__name__
             if attempt < cfg.max_retries - 1:
-                _sleep_jitter(cfg.min_delay_seconds, cfg.max_delay_seconds)
+                _sleep_backoff(attempt, cfg)
                 continue
             return f"爬虫失败 ({last_error})", f"爬虫失败 ({last_error})"
         except Exception as e:
@@ -121,18 +375,13 @@ def get_amazon_seller_info(asin: str, cfg: AnalyzerConfig) -> Tuple[str, str]:
     return "爬虫失败 (超出重试次数)", "爬虫失败 (超出重试次数)"
 
 
-def create_analysis_prompt(product_title: str, product_desc: str, brand: str, sold_by: str) -> str:
-    return f"""
+_PROMPT_ROLE = """
 [角色设定]
 你是一位顶级的亚马逊跨境电商选品风险评估专家。你的任务是根据提供的产品信息和图片，对产品进行严格、全面的风险评估。
 请务必使用你内置的知识库，对标题、图片和描述中出现的品牌或Logo进行最严格比对。
+""".strip()
 
-[待分析的产品文本信息]
-产品名称: {product_title}
-产品描述/要点: {product_desc}
-亚马逊品牌信息: {brand}
-亚马逊销售方信息: {sold_by}
-
+_PROMPT_RULES = """
 [风险禁令清单 - 重点关注商标和擦边球]
 请严格检查产品是否触犯以下任一禁令，并在理由中明确指出：
 1. 商标/擦边球侵权风险 (高风险 - 重点检查): 标题、描述、产品介绍或图片是否使用了未授权的知名品牌名称或 Logo？
@@ -140,49 +389,258 @@ def create_analysis_prompt(product_title: str, product_desc: str, brand: str, so
 2. 外观/实用专利风险警示：外观设计是否与已知知名品牌设计高度相似？（仅提供高风险警示）
 3. 特殊认证/合规风险：是否属于 FDA 认证产品（如食品、医疗器械）、儿童玩具（CPC）或电子产品（涉及 FCC/CE/UL/WEEE/RoHS 等复杂认证）？请在分析理由中明确提示所需合规文件或风险点。
 4. 产品形态禁令 (中/高风险)：是否属于粉末、液体、气体、危险品等。
+""".strip()
+
+_PROMPT_ADVICE_NOTE = '特别要求：在 "风险规避建议" 字段中，请使用编号列表（1. 2. 3.），并取消使用星号或其他特殊符号。'
+
+_PROMPT_FIELDS = """
+  "综合风险等级": "低风险/中风险/高风险",
+  "是否符合要求": "是/否",
+  "主要风险类型": ["商标侵权", "外观专利", "形态管制", "合规风险", "无"],
+  "分析理由": "...",
+  "风险规避建议": "..."
+""".strip("\n")
+
+
+def create_analysis_prompt(product_title: str, product_desc: str, brand: str, sold_by: str) -> str:
+    return f"""
+{_PROMPT_ROLE}
+
+[待分析的产品文本信息]
+产品名称: {product_title}
+产品描述/要点: {product_desc}
+亚马逊品牌信息: {brand}
+亚马逊销售方信息: {sold_by}
+
+{_PROMPT_RULES}
 
 [输出格式要求]
 你的输出必须是且仅是一个 JSON 对象。不要包含任何说明文字，不要添加任何前言或总结。
 你的输出必须从 {{ 开始，到 }} 结束，且是标准的 JSON 格式。
 
-特别要求：在 "风险规避建议" 字段中，请使用编号列表（1. 2. 3.），并取消使用星号或其他特殊符号。
+{_PROMPT_ADVICE_NOTE}
 
 JSON必须包含以下字段：
 {{
-  "综合风险等级": "低风险/中风险/高风险",
-  "是否符合要求": "是/否",
-  "主要风险类型": ["商标侵权", "外观专利", "形态管制", "合规风险", "无"],
-  "分析理由": "...",
-  "风险规避建议": "..."
+{_PROMPT_FIELDS}
 }}
 """.strip()
 
 
-def _extract_json(text: str) -> Dict[str, Any]:
+def create_batch_analysis_prompt(products: List[Tuple[str, str, str, str]]) -> str:
+    # 角色设定和禁令清单只发送一次，多个产品共用
+    product_blocks = "\n\n".join(
+        f"""### 产品 {n}
+产品名称: {product_title}
+产品描述/要点: {product_desc}
+亚马逊品牌信息: {brand}
+亚马逊销售方信息: {sold_by}"""
+        for n, (product_title, product_desc, brand, sold_by) in enumerate(products, start=1)
+    )
+    return f"""
+{_PROMPT_ROLE}
+
+[待分析的产品文本信息]
+以下共 {len(products)} 个产品，请逐个独立评估，互不参考。产品图片附在本提示之后，并标注为"产品 N 的图片"。
+
+{product_blocks}
+
+{_PROMPT_RULES}
+
+[输出格式要求]
+你的输出必须是且仅是一个 JSON 数组，按产品编号顺序为每个产品给出一个 JSON 对象，共 {len(products)} 个。不要包含任何说明文字，不要添加任何前言或总结。
+你的输出必须从 [ 开始，到 ] 结束，且是标准的 JSON 格式。
+
+{_PROMPT_ADVICE_NOTE}
+
+数组中的每个 JSON 对象必须包含以下字段：
+{{
+  "产品编号": 1,
+{_PROMPT_FIELDS}
+}}
+""".strip()
+
+
+def _extract_json(text: str, array: bool = False) -> Any:
     if not text:
         raise json.JSONDecodeError("Empty response", "", 0)
 
+    # 开启 JSON 输出模式后，大多数返回本身就是合法 JSON；顶层类型不符（如单个产品却返回数组）时继续走下面的提取
+    try:
+        parsed = _json_loads(text)
+        if isinstance(parsed, list if array else dict):
+            return parsed
+    except json.JSONDecodeError:
+        pass
+
     cleaned = text.strip().replace("```json", "").replace("```", "").strip()
 
-    start = cleaned.find("{")
-    end = cleaned.rfind("}")
+    opener, closer, pattern = ("[", "]", _JSON_ARRAY_RE) if array else ("{", "}", _JSON_BLOB_RE)
+    start = cleaned.find(opener)
+    end = cleaned.rfind(closer)
     if start == -1 or end == -1 or end <= start:
-        m = re.search(r"\{.*\}", cleaned, re.DOTALL)
+        m = pattern.search(cleaned)
         if not m:
             raise json.JSONDecodeError("JSON 匹配失败", cleaned, 0)
         cleaned = m.group(0)
     else:
         cleaned = cleaned[start : end + 1]
 
-    return json.loads(cleaned)
+    return _json_loads(cleaned)
+
+
+def _response_cache_key(model: str, prompt: str, image: Optional[Tuple[str, bytes]]) -> str:
+    h = hashlib.sha256()
+    h.update(model.encode("utf-8"))
+    h.update(b"\0")
+    h.update(prompt.encode("utf-8"))
+    if image is not None:
+        h.update(b"\0")
+        h.update(image[1])
+    return h.hexdigest()
+
+
+def _cache_get(key: str, cfg: AnalyzerConfig) -> Optional[Dict[str, Any]]:
+    if cfg.cache_ttl_seconds <= 0:
+        return None
+    with _RESPONSE_CACHE_LOCK:
+        entry = _RESPONSE_CACHE.get(key)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if time.time() - stored_at > cfg.cache_ttl_seconds:
+            del _RESPONSE_CACHE[key]
+            return None
+        return dict(result)
+
+
+def _cache_put(key: str, result: Dict[str, Any], cfg: AnalyzerConfig) -> None:
+    if cfg.cache_ttl_seconds <= 0:
+        return
+    with _RESPONSE_CACHE_LOCK:
+        _RESPONSE_CACHE.pop(key, None)
+        _RESPONSE_CACHE[key] = (time.time(), dict(result))
+        while len(_RESPONSE_CACHE) > _RESPONSE_CACHE_MAX:
+            del _RESPONSE_CACHE[next(iter(_RESPONSE_CACHE))]
+
+
+_JSON_RESPONSE_CONFIG = types.GenerateContentConfig(response_mime_type="application/json")
+
+
+def _error_result(brand: str, sold_by: str, risk_level: str, reason: str) -> Dict[str, Any]:
+    return {
+        "Brand (Amazon)": brand,
+        "Sold By (Amazon)": sold_by,
+        "综合风险等级": risk_level,
+        "是否符合要求": "",
+        "主要风险类型": "",
+        "风险规避建议": "",
+        "分析理由": reason,
+        "侵权溯源链接": "",
+    }
+
+
+def _payload_to_result(payload: Dict[str, Any], brand: str, sold_by: str, model_text: str) -> Dict[str, Any]:
+    risk_types = payload.get("主要风险类型", "")
+    if isinstance(risk_types, list):
+        risk_types_str = ", ".join([str(x) for x in risk_types])
+    else:
+        risk_types_str = str(risk_types)
+
+    return {
+        "Brand (Amazon)": brand,
+        "Sold By (Amazon)": sold_by,
+        "综合风险等级": payload.get("综合风险等级", "解析失败"),
+        "是否符合要求": payload.get("是否符合要求", "解析失败"),
+        "主要风险类型": risk_types_str,
+        "风险规避建议": payload.get("风险规避建议", ""),
+        "分析理由": payload.get("分析理由", model_text),
+        "侵权溯源链接": "",
+    }
+
+
+def _resolve_seller_info(
+    asin: str,
+    cfg: AnalyzerConfig,
+    brand_override: Optional[str] = None,
+    sold_by_override: Optional[str] = None,
+) -> Tuple[str, str]:
+    if brand_override or sold_by_override:
+        return brand_override or "", sold_by_override or ""
+
+    # asin 需已规范化（app.py 批量预处理，analyze_product 单独处理），这里只校验长度
+    if asin and len(asin) == 10:
+        return _cached_seller_info(asin, cfg)
+    return "待处理", "待处理"
+
+
+def _cached_seller_info(asin: str, cfg: AnalyzerConfig) -> Tuple[str, str]:
+    # 同一次运行中相同 ASIN 只抓取一次；其它 worker 遇到正在抓取的 ASIN 时等待同一个结果
+    with cfg.seller_cache_lock:
+        future = cfg.seller_cache.get(asin)
+        owner = future is None
+        if owner:
+            future = cfg.seller_cache[asin] = Future()
+
+    if owner:
+        try:
+            future.set_result(get_amazon_seller_info(asin, cfg))
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+    return future.result()
 
 
-def _build_client(api_key: str) -> genai.Client:
-    return genai.Client(api_key=api_key)
+def _analyze_prepared(
+    client: genai.Client,
+    product_title: str,
+    product_desc: str,
+    brand: str,
+    sold_by: str,
+    image: Optional[Tuple[str, bytes]],
+    cfg: AnalyzerConfig,
+) -> Dict[str, Any]:
+    prompt = create_analysis_prompt(product_title, product_desc, brand, sold_by)
+    contents: list[Any] = [prompt]
+    if image is not None:
+        mime_type, data = image
+        contents.append(types.Part.from_bytes(data=data, mime_type=mime_type))
+
+    cache_key = _response_cache_key(cfg.model, prompt, image)
+    cached = _cache_get(cache_key, cfg)
+    if cached is not None:
+        return cached
+
+    try:
+        with cfg.gemini_limiter:
+            resp = client.models.generate_content(model=cfg.model, contents=contents, config=_JSON_RESPONSE_CONFIG)
+        model_text = getattr(resp, "text", "")
+    except APIError as e:
+        _sleep_jitter(cfg.min_delay_seconds, cfg.max_delay_seconds)
+        return _error_result(brand, sold_by, "API ERROR", f"API ERROR: {e}")
+    except Exception as e:
+        _sleep_jitter(cfg.min_delay_seconds, cfg.max_delay_seconds)
+        return _error_result(brand, sold_by, "MODEL ERROR", f"MODEL ERROR: {e}")
+
+    try:
+        payload = _extract_json(model_text)
+        result = _payload_to_result(payload, brand, sold_by, model_text)
+    except Exception as e:
+        return _error_result(
+            brand,
+            sold_by,
+            "AI失败/格式错误",
+            f"分析失败。错误: {e}. 原始返回: {model_text[:300]}...",
+        )
+
+    # 与批量路径一致：缺少风险等级的结论不完整，不写入缓存
+    if "综合风险等级" in payload:
+        _cache_put(cache_key, result, cfg)
+    return result
 
 
 def analyze_product(
-    api_key: str,
+    client: genai.Client,
     product_title: str,
     product_desc: str,
     asin: str,
@@ -191,79 +649,125 @@ def analyze_product(
     brand_override: Optional[str] = None,
     sold_by_override: Optional[str] = None,
 ) -> Dict[str, Any]:
-    client = _build_client(api_key)
+    asin = extract_asin(asin) or asin
+    brand, sold_by = _resolve_seller_info(asin, cfg, brand_override, sold_by_override)
+    image = download_image(image_url, cfg) if image_url else None
 
-    brand, sold_by = ("待处理", "待处理")
-    if brand_override or sold_by_override:
-        brand = brand_override or ""
-        sold_by = sold_by_override or ""
-    else:
-        asin_extracted = extract_asin(asin) or asin
-        if asin_extracted and len(asin_extracted) == 10:
-            brand, sold_by = get_amazon_seller_info(asin_extracted, cfg)
+    return _analyze_prepared(client, product_title, product_desc, brand, sold_by, image, cfg)
 
-    image = download_image_as_pil(image_url, cfg) if image_url else None
 
-    prompt = create_analysis_prompt(product_title, product_desc, brand, sold_by)
-    contents: list[Any] = [prompt]
-    if image is not None:
-        contents.append(image)
+_PreparedRow = Tuple[ProductRow, str, str, Optional[Tuple[str, bytes]]]
 
+
+def _analyze_batch_prepared(
+    client: genai.Client,
+    items: List[_PreparedRow],
+    cfg: AnalyzerConfig,
+) -> List[Optional[Dict[str, Any]]]:
+    prompt = create_batch_analysis_prompt(
+        [(row.product_title, row.product_desc, brand, sold_by) for row, brand, sold_by, _ in items]
+    )
+    contents: list[Any] = [prompt]
+    for n, (_, _, _, image) in enumerate(items, start=1):
+        if image is not None:
+            mime_type, data = image
+            contents.append(f"产品 {n} 的图片：")
+            contents.append(types.Part.from_bytes(data=data, mime_type=mime_type))
+
+    # 限流、配额或服务端故障（429/5xx）时整批直接返回错误，拆成单个请求只会放大失败次数；
+    # 其他 API 错误（如 400）可能只是某个产品的图片或输入有问题，和解析失败一样逐个重试
     try:
-        resp = client.models.generate_content(model=cfg.model, contents=contents)
-        _sleep_jitter(cfg.min_delay_seconds, cfg.max_delay_seconds)
+        with cfg.gemini_limiter:
+            resp = client.models.generate_content(model=cfg.model, contents=contents, config=_JSON_RESPONSE_CONFIG)
         model_text = getattr(resp, "text", "")
     except APIError as e:
+        if not _is_throttle_error(e):
+            return [None] * len(items)
         _sleep_jitter(cfg.min_delay_seconds, cfg.max_delay_seconds)
-        return {
-            "Brand (Amazon)": brand,
-            "Sold By (Amazon)": sold_by,
-            "综合风险等级": "API ERROR",
-            "是否符合要求": "",
-            "主要风险类型": "",
-            "风险规避建议": "",
-            "分析理由": f"API ERROR: {e}",
-            "侵权溯源链接": "",
-        }
+        return [_error_result(brand, sold_by, "API ERROR", f"API ERROR: {e}") for _, brand, sold_by, _ in items]
     except Exception as e:
         _sleep_jitter(cfg.min_delay_seconds, cfg.max_delay_seconds)
-        return {
-            "Brand (Amazon)": brand,
-            "Sold By (Amazon)": sold_by,
-            "综合风险等级": "MODEL ERROR",
-            "是否符合要求": "",
-            "主要风险类型": "",
-            "风险规避建议": "",
-            "分析理由": f"MODEL ERROR: {e}",
-            "侵权溯源链接": "",
-        }
+        return [_error_result(brand, sold_by, "MODEL ERROR", f"MODEL ERROR: {e}") for _, brand, sold_by, _ in items]
 
     try:
-        payload = _extract_json(model_text)
-        risk_types = payload.get("主要风险类型", "")
-        if isinstance(risk_types, list):
-            risk_types_str = ", ".join([str(x) for x in risk_types])
+        payload = _extract_json(model_text, array=True)
+    except Exception:
+        return [None] * len(items)
+
+    if not isinstance(payload, list):
+        return [None] * len(items)
+
+    by_number = _match_batch_entries(payload, len(items))
+    if by_number is None:
+        return [None] * len(items)
+
+    results: List[Optional[Dict[str, Any]]] = []
+    for n, (row, brand, sold_by, image) in enumerate(items, start=1):
+        entry = by_number.get(n)
+        if entry is None:
+            results.append(None)
+            continue
+        result = _payload_to_result(entry, brand, sold_by, "")
+        # 缺少风险等级的结论不完整，不写入缓存，避免 24 小时内反复复用
+        if "综合风险等级" in entry:
+            prompt = create_analysis_prompt(row.product_title, row.product_desc, brand, sold_by)
+            _cache_put(_response_cache_key(cfg.model, prompt, image), result, cfg)
+        results.append(result)
+    return results
+
+
+def _is_throttle_error(e: APIError) -> bool:
+    code = getattr(e, "code", None)
+    return isinstance(code, int) and (code == 429 or code >= 500)
+
+
+def _batch_entry_number(entry: Dict[str, Any], count: int) -> Optional[int]:
+    try:
+        number = int(entry.get("产品编号"))
+    except (TypeError, ValueError):
+        return None
+    return number if 1 <= number <= count else None
+
+
+def _match_batch_entries(payload: List[Any], count: int) -> Optional[Dict[int, Dict[str, Any]]]:
+    # 结果与产品对不上号时宁可整批逐个重试，也不能把别的产品的结论安到当前产品上
+    if not all(isinstance(entry, dict) for entry in payload):
+        return None
+
+    numbers = [_batch_entry_number(entry, count) for entry in payload]
+    if all(n is not None for n in numbers) and len(set(numbers)) == len(numbers):
+        return dict(zip(numbers, payload))
+
+    if len(payload) == count and all(n is None or n == pos for pos, n in enumerate(numbers, start=1)):
+        return dict(enumerate(payload, start=1))
+
+    return None
+
+
+def analyze_products_batch(client: genai.Client, rows: List[ProductRow], cfg: AnalyzerConfig) -> List[Dict[str, Any]]:
+    prepared: List[_PreparedRow] = []
+    for row in rows:
+        brand, sold_by = _resolve_seller_info(row.asin, cfg, row.brand_override, row.sold_by_override)
+        image = download_image(row.image_url, cfg) if row.image_url else None
+        prepared.append((row, brand, sold_by, image))
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(prepared)
+    pending: List[int] = []
+    for i, (row, brand, sold_by, image) in enumerate(prepared):
+        prompt = create_analysis_prompt(row.product_title, row.product_desc, brand, sold_by)
+        cached = _cache_get(_response_cache_key(cfg.model, prompt, image), cfg)
+        if cached is not None:
+            results[i] = cached
         else:
-            risk_types_str = str(risk_types)
-
-        return {
-            "Brand (Amazon)": brand,
-            "Sold By (Amazon)": sold_by,
-            "综合风险等级": payload.get("综合风险等级", "解析失败"),
-            "是否符合要求": payload.get("是否符合要求", "解析失败"),
-            "主要风险类型": risk_types_str,
-            "风险规避建议": payload.get("风险规避建议", ""),
-            "分析理由": payload.get("分析理由", model_text),
-            "侵权溯源链接": "",
-        }
-    except Exception as e:
-        return {
-            "Brand (Amazon)": brand,
-            "Sold By (Amazon)": sold_by,
-            "综合风险等级": "AI失败/格式错误",
-            "是否符合要求": "",
-            "主要风险类型": "",
-            "风险规避建议": "",
-            "分析理由": f"分析失败。错误: {e}. 原始返回: {model_text[:300]}...",
-            "侵权溯源链接": "",
-        }
+            pending.append(i)
+
+    if len(pending) > 1:
+        batch_results = _analyze_batch_prepared(client, [prepared[i] for i in pending], cfg)
+        for i, res in zip(pending, batch_results):
+            results[i] = res
+
+    # 批量请求失败或缺少某个产品的结果时，逐个单独分析兜底
+    return [
+        res if res is not None else _analyze_prepared(client, row.product_title, row.product_desc, brand, sold_by, image, cfg)
+        for res, (row, brand, sold_by, image) in zip(results, prepared)
+    ]
@@ -3,63 +3,83 @@
 from __future__ import annotations
 
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO
 
 import pandas as pd
 import streamlit as st
 import xlsxwriter
+from google import genai
 
-from analyzer import AnalyzerConfig, analyze_product, extract_asin
+from analyzer import ASIN_BARE_RE, ASIN_DP_RE, AnalyzerConfig, ProductRow, analyze_products_batch
+
+
+_TAB_TABLE = str.maketrans({"\n": " ", "\r": " ", "\t": " "})
 
 
 def _clean_cell(value):
     if value is None:
         return ""
     if isinstance(value, str):
-        return value.replace("\n", " ").replace("\r", " ").replace("\t", " ")
+        return value.translate(_TAB_TABLE)
     return str(value)
 
 
+def _excel_value(value):
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    return value
+
+
 def build_report_bytes(df: pd.DataFrame) -> bytes:
     output = BytesIO()
 
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        df.to_excel(writer, sheet_name="分析结果", index=False)
-
-        workbook = writer.book
-        worksheet = writer.sheets["分析结果"]
-
-        format_low = workbook.add_format({"bg_color": "#C6EFCE", "font_color": "#006100"})
-        format_medium = workbook.add_format({"bg_color": "#FFEB9C", "font_color": "#9C6500"})
-        format_high = workbook.add_format({"bg_color": "#FFC7CE", "font_color": "#9C0006"})
-        format_fail = workbook.add_format({"bg_color": "#D9D9D9", "font_color": "#000000"})
-
-        header = df.columns.tolist()
-        if "综合风险等级" in header:
-            risk_col_num = header.index("综合风险等级")
-            col_letter = xlsxwriter.utility.xl_col_to_name(risk_col_num)
-            last_row = len(df)
-
-            worksheet.conditional_format(
-                f"{col_letter}2:{col_letter}{last_row + 1}",
-                {"type": "text", "criteria": "containing", "value": "低风险", "format": format_low},
-            )
-            worksheet.conditional_format(
-                f"{col_letter}2:{col_letter}{last_row + 1}",
-                {"type": "text", "criteria": "containing", "value": "中风险", "format": format_medium},
-            )
-            worksheet.conditional_format(
-                f"{col_letter}2:{col_letter}{last_row + 1}",
-                {"type": "text", "criteria": "containing", "value": "高风险", "format": format_high},
-            )
-            worksheet.conditional_format(
-                f"{col_letter}2:{col_letter}{last_row + 1}",
-                {"type": "text", "criteria": "containing", "value": "失败", "format": format_fail},
-            )
-
+    # constant_memory：逐行写出并落盘，内存中只保留当前行
+    workbook = xlsxwriter.Workbook(
+        output,
+        {"constant_memory": True, "default_date_format": "yyyy-mm-dd hh:mm:ss"},
+    )
+    worksheet = workbook.add_worksheet("分析结果")
+
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    format_low = workbook.add_format({"bg_color": "#C6EFCE", "font_color": "#006100"})
+    format_medium = workbook.add_format({"bg_color": "#FFEB9C", "font_color": "#9C6500"})
+    format_high = workbook.add_format({"bg_color": "#FFC7CE", "font_color": "#9C0006"})
+    format_fail = workbook.add_format({"bg_color": "#D9D9D9", "font_color": "#000000"})
+
+    # 与原先四条条件格式的优先级一致：按顺序取第一个命中的格式
+    risk_formats = [
+        ("低风险", format_low),
+        ("中风险", format_medium),
+        ("高风险", format_high),
+        ("失败", format_fail),
+    ]
+
+    header = df.columns.tolist()
+    worksheet.write_row(0, 0, header, header_format)
+
+    risk_col_num = header.index("综合风险等级") if "综合风险等级" in header else None
+
+    for row_num, values in enumerate(df.itertuples(index=False, name=None), start=1):
+        cells = [_excel_value(v) for v in values]
+        worksheet.write_row(row_num, 0, cells)
+
+        if risk_col_num is not None and cells[risk_col_num] is not None:
+            risk_value = str(cells[risk_col_num])
+            risk_format = next((fmt for text, fmt in risk_formats if text in risk_value), None)
+            if risk_format is not None:
+                worksheet.write(row_num, risk_col_num, cells[risk_col_num], risk_format)
+
+    workbook.close()
     return output.getvalue()
 
 
+@st.cache_resource
+def _get_client(api_key: str) -> genai.Client:
+    # 同一个 API Key 在整个会话内复用一个客户端，避免每行都重新建立连接
+    return genai.Client(api_key=api_key)
+
+
 st.set_page_config(page_title="选品侵权风险分析", layout="wide")
 
 st.title("选品侵权风险分析")
@@ -114,6 +134,9 @@ with st.sidebar:
     min_delay = st.number_input("请求间最小延迟(秒)", min_value=0.0, max_value=60.0, value=2.0, step=0.5)
     max_delay = st.number_input("请求间最大延迟(秒)", min_value=0.0, max_value=60.0, value=6.0, step=0.5)
 
+    concurrency = st.number_input("并发数", min_value=1, max_value=16, value=4, step=1)
+    batch_size = st.number_input("每次请求产品数", min_value=1, max_value=10, value=5, step=1)
+
     st.caption("提示：亚马逊页面可能会触发验证码，抓取 Brand/Sold By 可能失败。")
 
 st.subheader("上传 Excel")
@@ -170,37 +193,71 @@ if not api_key:
 if not run:
     st.stop()
 
-cfg = AnalyzerConfig(model=model, min_delay_seconds=float(min_delay), max_delay_seconds=float(max_delay), verify_ssl=bool(verify_ssl))
+cfg = AnalyzerConfig(
+    model=model,
+    min_delay_seconds=float(min_delay),
+    max_delay_seconds=float(max_delay),
+    verify_ssl=bool(verify_ssl),
+    concurrency=int(concurrency),
+    batch_size=int(batch_size),
+)
+
+client = _get_client(api_key)
 
 progress = st.progress(0)
 status = st.empty()
 
 total = len(df)
 
-for i in range(total):
-    row = df.iloc[i]
-    title = _clean_cell(row.get("产品标题", ""))
-    desc = _clean_cell(row.get("产品描述", ""))
-    asin_raw = _clean_cell(row.get("ASIN", ""))
-    image_url = _clean_cell(row.get("产品图片链接", ""))
+input_columns = ["产品标题", "产品描述", "ASIN", "产品图片链接"]
+inputs = df[input_columns].fillna("").astype(str).apply(lambda c: c.str.translate(_TAB_TABLE))
+
+# 与 extract_asin 规则一致：优先取 /dp/ 后的 ASIN，其次取独立的 10 位编码，都没有则保留原值
+asin_raw = inputs["ASIN"]
+asins = (
+    asin_raw.str.extract(ASIN_DP_RE, expand=False)
+    .fillna(asin_raw.str.extract(ASIN_BARE_RE, expand=False))
+    .str.upper()
+    .fillna(asin_raw)
+)
 
-    asin = extract_asin(asin_raw) or asin_raw
+rows = [
+    ProductRow(product_title=title, product_desc=desc, asin=asin, image_url=image_url)
+    for title, desc, asin, image_url in zip(inputs["产品标题"], inputs["产品描述"], asins, inputs["产品图片链接"])
+]
 
-    status.write(f"正在分析 {i + 1}/{total} | ASIN: {asin}")
+status.write(f"正在分析 0/{total}")
 
-    res = analyze_product(
-        api_key=api_key,
-        product_title=title,
-        product_desc=desc,
-        asin=asin,
-        image_url=image_url,
-        cfg=cfg,
-    )
+# 每行的 Amazon 抓取、图片下载和 Gemini 调用都是 IO 密集，用线程池让多批并行；
+# 每批最多 batch_size 个产品合并成一次 Gemini 请求
+chunk_size = max(1, cfg.batch_size)
+chunks = [range(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
 
-    for k, v in res.items():
-        df.at[df.index[i], k] = _clean_cell(v)
+results: list = [None] * total
 
-    progress.progress(int(((i + 1) / total) * 100))
+# 不用 with：点击 Stop 或重跑时 Streamlit 会在循环里抛出停止异常，
+# 此时要取消还在排队的批次，避免继续抓 Amazon、调用计费的 Gemini，也不阻塞重跑
+executor = ThreadPoolExecutor(max_workers=cfg.concurrency)
+try:
+    futures = {
+        executor.submit(analyze_products_batch, client, [rows[i] for i in chunk], cfg): chunk
+        for chunk in chunks
+    }
+
+    done = 0
+    for future in as_completed(futures):
+        chunk = futures[future]
+        for i, res in zip(chunk, future.result()):
+            results[i] = {k: _clean_cell(v) for k, v in res.items()}
+
+        done += len(chunk)
+        status.write(f"正在分析 {done}/{total} | ASIN: {rows[chunk[-1]].asin}")
+        progress.progress(int((done / total) * 100))
+finally:
+    executor.shutdown(wait=False, cancel_futures=True)
+
+# 结果先缓存在列表里，最后一次性写回 DataFrame
+df[result_columns] = pd.DataFrame(results, columns=result_columns).values
 
 st.success("分析完成")
 